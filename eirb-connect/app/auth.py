@@ -2,10 +2,11 @@
 This module contains the authentication logic
 """
 
+import time
 from datetime import datetime, timedelta
 from typing import Annotated
 
-from app.utils import get_password_hash, verify_password
+from app.utils import get_password_hash, verify_password, get_service_scope
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 
@@ -15,13 +16,41 @@ from pydantic import BaseModel
 import requests
 
 from app.models import CasUser, CasUserAttributes, User
-from app.conf import mongodb, SECRET_KEY, ACCES_TOKEN_EXPIRE_MINUTES, ALGORITHM
+from app.conf import (
+    mongodb,
+    mongodb_read,
+    SECRET_KEY,
+    ACCES_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    CAS_VALIDATE_URL,
+    CAS_TIMEOUT,
+    CAS_FALLBACK,
+    CAS_RETRY_AFTER,
+)
+from app.tracing import traced
+from app.claims import get_claims, scope_claims
 
 from bson.objectid import ObjectId
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Time until which the CAS is considered unavailable (degraded mode)
+cas_unavailable_until = 0.0
+
+
+class CasUnavailableError(Exception):
+    """
+    Raised when the CAS doesn't answer in time or answers with an error
+    """
+
+
+def is_cas_available() -> bool:
+    """
+    Check if the CAS can be called (always True without degraded mode)
+    """
+    return not CAS_FALLBACK or time.monotonic() >= cas_unavailable_until
+
 
 # Pydantic Model that will be used in the
 # token endpoint for the response
@@ -49,12 +78,19 @@ class Payload(BaseModel):
 # Helper token functions
 
 
-def create_access_token(data: dict):
+@traced
+def create_access_token(data: dict, service_url: str | None = None):
     """
     Create the access token with the data and return it
+    The roles of the user, filtered for "service_url", are added to the token
     """
     to_encode = data.copy()
 
+    if "user" in data:
+        to_encode["roles"] = scope_claims(
+            get_claims(data["user"]), get_service_scope(service_url)
+        )
+
     # expire time of the token
     expire = datetime.utcnow() + timedelta(minutes=ACCES_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire, "iss": "EirbConnect"})
@@ -64,6 +100,7 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+@traced
 def verify_token(token: str):
     """
     If the token is valid return the payload
@@ -79,17 +116,32 @@ def verify_token(token: str):
         ) from exc
 
 
+@traced
 def get_cas_user_from_ticket(ticket: str, service_url: str) -> CasUser | None:
     """
     Return the user from the CAS ticket
+    Raise CasUnavailableError if the CAS doesn't answer in time, answers with
+    an HTTP error (e.g. a 502 page of its proxy) or with an invalid response
     """
-    res = requests.get(
-        f"https://cas.bordeaux-inp.fr/serviceValidate?service={service_url}&ticket={ticket}&format=json",
-        timeout=5,
-    ).json()
+    global cas_unavailable_until  # pylint: disable=global-statement
+
+    # En mode dégradé, on n'attend pas un CAS qui vient de tomber
+    if not is_cas_available():
+        raise CasUnavailableError("CAS unavailable")
+
+    try:
+        response = requests.get(
+            f"{CAS_VALIDATE_URL}?service={service_url}&ticket={ticket}&format=json",
+            timeout=CAS_TIMEOUT,
+        )
+        response.raise_for_status()
+        service_response = response.json()["serviceResponse"]
+    except (requests.RequestException, ValueError, KeyError, TypeError) as exc:
+        cas_unavailable_until = time.monotonic() + CAS_RETRY_AFTER
+        raise CasUnavailableError("CAS unavailable") from exc
 
-    if "authenticationSuccess" in res["serviceResponse"]:
-        user_response = res["serviceResponse"]["authenticationSuccess"]
+    if "authenticationSuccess" in service_response:
+        user_response = service_response["authenticationSuccess"]
 
         user = CasUser(
             user=user_response["user"],
@@ -113,10 +165,11 @@ def get_cas_user_from_ticket(ticket: str, service_url: str) -> CasUser | None:
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail=res["serviceResponse"]["authenticationFailure"],
+        detail=service_response.get("authenticationFailure"),
     )
 
 
+@traced
 def update_user(cas_user: CasUser):
     """
     Update the user in the db
@@ -126,6 +179,14 @@ def update_user(cas_user: CasUser):
     mongo_user = mongodb.utilisateurs.find_one({"user": cas_user_dict["user"]})
 
     if mongo_user:
+        # Pas d'écriture si les attributs "cas" n'ont pas changé
+        # (cas courant après un import avec app.sync)
+        if all(
+            mongo_user["attributes"].get(key) == value
+            for key, value in cas_user_dict["attributes"].items()
+        ):
+            return
+
         # On met a jour tous les attributs "cas" de l'utilisateur
         for key in cas_user_dict["attributes"]:
             mongo_user["attributes"][key] = cas_user_dict["attributes"][key]
@@ -141,15 +202,19 @@ def update_user(cas_user: CasUser):
     )
 
 
-def get_user(cas_id: str) -> User | None:
+@traced
+def get_user(cas_id: str, read_only: bool = False) -> User | None:
     """
     Get an EirbConnect user with a cas id
+    The read_only lookups use the read preference (MONGO_READ_PREFERENCE),
+    the others the primary, to read the writes of the request
     """
-    user = mongodb.utilisateurs.find_one({"user": cas_id})
+    db = mongodb_read if read_only else mongodb
+    user = db.utilisateurs.find_one({"user": cas_id})
     if user:
         if user["roles"]:
             for i, role in enumerate(user["roles"]):
-                asso = mongodb.assos.find_one(ObjectId(role["id_asso"]))
+                asso = db.assos.find_one(ObjectId(role["id_asso"]))
                 user["roles"][i]["nom_asso"] = asso["name"] if asso else ""
                 del user["roles"][i]["id_asso"]
         return User(**user)
@@ -160,7 +225,7 @@ def get_user_with_id_and_password(cas_id: str, password: str) -> User | None:
     """
     Log an EirbConnect user with a cas id and a password
     """
-    user = get_user(cas_id)
+    user = get_user(cas_id, read_only=True)
     if user:
         if verify_password(password, user.password):
             return user
@@ -194,6 +259,7 @@ def get_user_from_token(token: str) -> CasUser | None:
     return CasUser(**payload.payload)
 
 
+@traced
 def register_user(cas_user: CasUser, email_personnel: str, password: str):
     """
     Register a user
@@ -231,6 +297,7 @@ def register_user(cas_user: CasUser, email_personnel: str, password: str):
     return mongodb.utilisateurs.find_one({"user": cas_user.user})
 
 
+@traced
 def login_user_with_password(cas_id: str, password: str):
     """
     Login a user
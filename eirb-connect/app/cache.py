@@ -0,0 +1,165 @@
+"""
+This module contains the cache shared by the service and user lookups
+
+The backend is chosen with CACHE_URL :
+  - empty : in-process cache (one per instance)
+  - redis://host:port/db : Redis (or any Redis-compatible server), shared by
+    every instance of EirbConnect
+
+The values must be JSON serializable.
+"""
+
+import json
+import re
+import time
+from typing import Any, Callable
+
+from app.conf import CACHE_URL, CACHE_PREFIX, CACHE_TTL
+
+# Timeout of the Redis connection and commands (seconds)
+REDIS_TIMEOUT = 0.25
+
+# Time a failing Redis server is skipped, the lookups going to the db
+REDIS_RETRY_AFTER = 30.0
+
+
+class InMemoryCache:
+    """
+    In-process cache
+    """
+
+    def __init__(self):
+        # key -> (expiration time, value)
+        self.values: dict[str, tuple[float, Any]] = {}
+
+    def get(self, key: str) -> Any | None:
+        """
+        Get a value, None if missing or expired
+        """
+        cached = self.values.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        self.values.pop(key, None)
+        return None
+
+    def set(self, key: str, value: Any, ttl: float):
+        """
+        Set a value for "ttl" seconds
+        """
+        self.values[key] = (time.monotonic() + ttl, value)
+
+    def delete(self, key: str):
+        """
+        Delete a value
+        """
+        self.values.pop(key, None)
+
+    def delete_prefix(self, prefix: str):
+        """
+        Delete every value whose key starts with "prefix"
+        """
+        # Snapshot of the keys : the dict may change in another thread meanwhile
+        for key in list(self.values):
+            if key.startswith(prefix):
+                self.values.pop(key, None)
+
+
+class RedisCache:
+    """
+    Cache shared through a Redis-compatible server
+    Every key is prefixed with "prefix", the server may be shared with other
+    applications
+    If the server fails, it is skipped for REDIS_RETRY_AFTER seconds and the
+    lookups go to the db
+    """
+
+    def __init__(self, url: str, prefix: str = CACHE_PREFIX):
+        # Only needed with a Redis cache
+        # pylint: disable=import-outside-toplevel
+        import redis
+        from redis.backoff import NoBackoff
+        from redis.retry import Retry
+
+        self.client = redis.Redis.from_url(
+            url,
+            socket_timeout=REDIS_TIMEOUT,
+            socket_connect_timeout=REDIS_TIMEOUT,
+            # No retry : a failure opens the circuit breaker instead
+            retry=Retry(NoBackoff(), 0),
+            # RESP2 is understood by every Redis-compatible server
+            protocol=2,
+        )
+        self.prefix = prefix
+        self.error = redis.RedisError
+        self.unavailable_until = 0.0
+
+    def call(self, command: Callable, *args, **kwargs) -> Any | None:
+        """
+        Run a Redis command, None if the server is failing
+        """
+        if time.monotonic() < self.unavailable_until:
+            return None
+        try:
+            return command(*args, **kwargs)
+        except self.error as exc:
+            print(f"Redis cache unavailable : {exc}")
+            self.unavailable_until = time.monotonic() + REDIS_RETRY_AFTER
+            return None
+
+    def get(self, key: str) -> Any | None:
+        """
+        Get a value, None if missing or expired
+        """
+        value = self.call(self.client.get, self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: float):
+        """
+        Set a value for "ttl" seconds
+        """
+        self.call(
+            self.client.set, self.prefix + key, json.dumps(value), px=int(ttl * 1000)
+        )
+
+    def delete(self, key: str):
+        """
+        Delete a value
+        """
+        self.call(self.client.delete, self.prefix + key)
+
+    def delete_prefix(self, prefix: str):
+        """
+        Delete every value whose key starts with "prefix"
+        """
+        # The glob characters of the prefixes are escaped in the pattern
+        pattern = re.sub(r"([*?\[\]\\])", r"\\\1", self.prefix + prefix) + "*"
+        keys = self.call(lambda: list(self.client.scan_iter(match=pattern)))
+        if keys:
+            self.call(self.client.delete, *keys)
+
+
+def create_cache(url: str) -> InMemoryCache | RedisCache:
+    """
+    Create the cache backend of "url"
+    """
+    if not url:
+        return InMemoryCache()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url)
+    raise ValueError(f"Unsupported cache url : {url}")
+
+
+cache = create_cache(CACHE_URL)
+
+
+def cached(key: str, loader: Callable[[], Any], ttl: float = CACHE_TTL) -> Any:
+    """
+    Get a value from the cache, or load and cache it
+    (None values are not cached)
+    """
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        if value is not None:
+            cache.set(key, value, ttl)
+    return value
@@ -0,0 +1,142 @@
+"""
+This module contains the role claims stamped into the tokens
+
+The claims of a user are the list of its roles (nom_asso, mandat, postes).
+They are computed once and kept in the shared cache.
+When MongoDB runs as a replica set, a change stream on "utilisateurs" and
+"assos" invalidates the cache as soon as the roles or the assos change, and
+the claims are kept for CLAIMS_CACHE_TTL seconds. While the change stream is
+not running (standalone MongoDB, interruption), a revoked role must not stay
+in the tokens : the claims are only kept for CLAIMS_FALLBACK_TTL seconds.
+"""
+
+import threading
+import time
+
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.conf import mongodb, CLAIMS_CACHE_TTL, CLAIMS_FALLBACK_TTL
+from app.cache import cache, cached
+
+# Error code of a change stream on a standalone server (not a replica set)
+NOT_A_REPLICA_SET = 40573
+
+# Delay before restarting an interrupted change stream, doubled at each failure
+WATCH_RETRY_DELAY = 1.0
+WATCH_MAX_RETRY_DELAY = 60.0
+
+# Set while the change stream is open
+watching = threading.Event()
+
+
+def build_claims(cas_id: str) -> list[dict]:
+    """
+    Compute the claims of a user from the db
+    The primary is read : after an invalidation, a secondary may still have
+    the old roles, which would be cached again
+    """
+    user = mongodb.utilisateurs.find_one({"user": cas_id}, {"roles": 1})
+    if not user or not user.get("roles"):
+        return []
+
+    asso_ids = [ObjectId(role["id_asso"]) for role in user["roles"]]
+    assos = {
+        asso["_id"]: asso["name"]
+        for asso in mongodb.assos.find({"_id": {"$in": asso_ids}}, {"name": 1})
+    }
+
+    return [
+        {
+            "nom_asso": assos.get(ObjectId(role["id_asso"]), ""),
+            "mandat": role["mandat"],
+            "postes": role["postes"],
+        }
+        for role in user["roles"]
+    ]
+
+
+def get_claims(cas_id: str) -> list[dict]:
+    """
+    Get the claims of a user from the cache
+    """
+    ttl = CLAIMS_CACHE_TTL if watching.is_set() else CLAIMS_FALLBACK_TTL
+    return cached(f"claims:{cas_id}", lambda: build_claims(cas_id), ttl)
+
+
+def invalidate_claims(cas_id: str | None = None):
+    """
+    Remove the claims of a user (or of every user) from the cache
+    """
+    if cas_id is None:
+        cache.delete_prefix("claims:")
+    else:
+        cache.delete(f"claims:{cas_id}")
+
+
+def scope_claims(claims: list[dict], scope: list[str] | None) -> list[dict]:
+    """
+    Keep only the roles in the assos of "scope" (every role if None)
+    """
+    if scope is None:
+        return claims
+    return [role for role in claims if role["nom_asso"] in scope]
+
+
+def watch_changes():
+    """
+    Invalidate the cache on changes of the roles or the assos
+    The change stream is restarted after a failure (election, network error)
+    from the last seen change, and given up only without a replica set
+    """
+    pipeline = [{"$match": {"ns.coll": {"$in": ["utilisateurs", "assos"]}}}]
+    resume_token = None
+    delay = WATCH_RETRY_DELAY
+
+    while True:
+        try:
+            with mongodb.watch(
+                pipeline, full_document="updateLookup", resume_after=resume_token
+            ) as stream:
+                if not watching.is_set():
+                    print(
+                        "Claims change stream open : the claims are cached for "
+                        f"CLAIMS_CACHE_TTL={CLAIMS_CACHE_TTL} s"
+                    )
+                watching.set()
+                for change in stream:
+                    user = (change.get("fullDocument") or {}).get("user")
+                    if change["ns"]["coll"] == "utilisateurs" and user:
+                        invalidate_claims(user)
+                    else:
+                        # Asso renamed or user deleted
+                        invalidate_claims()
+                    resume_token = stream.resume_token
+                    delay = WATCH_RETRY_DELAY
+        except OperationFailure as exc:
+            if exc.code == NOT_A_REPLICA_SET:
+                # Change streams need a replica set : the cache expires quickly
+                print(
+                    f"Claims change stream unavailable ({exc}) : the claims are "
+                    f"cached for CLAIMS_FALLBACK_TTL={CLAIMS_FALLBACK_TTL} s only"
+                )
+                return
+            # The resume token may be too old : start over from now, the
+            # changes in between are lost so every claim is invalidated
+            print(f"Claims change stream failed : {exc}")
+            resume_token = None
+            invalidate_claims()
+        except PyMongoError as exc:
+            print(f"Claims change stream interrupted : {exc}")
+        except Exception as exc:  # pylint: disable=broad-except
+            # Last resort : the watcher must not die, the invalidations would stop
+            print(f"Claims change stream failed : {exc}")
+
+        # Changes may be missed until the change stream is open again
+        watching.clear()
+        time.sleep(delay)
+        delay = min(delay * 2, WATCH_MAX_RETRY_DELAY)
+
+
+watcher = threading.Thread(target=watch_changes, daemon=True)
+watcher.start()
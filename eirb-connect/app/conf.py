@@ -20,11 +20,47 @@ ADMIN_PASS = os.getenv("ADMIN_PASS", DEFAULT_ADMIN_PASS)
 
 CAS_PROXY = os.getenv("CAS_PROXY", "")
 
+CAS_VALIDATE_URL = os.getenv(
+    "CAS_VALIDATE_URL", "https://cas.bordeaux-inp.fr/serviceValidate"
+)
+CAS_TIMEOUT = float(os.getenv("CAS_TIMEOUT", "5"))
+
+# Degraded mode : when the CAS doesn't answer, the users are sent to the
+# password login and the CAS is not called again for CAS_RETRY_AFTER seconds
+CAS_FALLBACK = os.getenv("CAS_FALLBACK", "false").lower() in ("1", "true", "yes")
+CAS_RETRY_AFTER = float(os.getenv("CAS_RETRY_AFTER", "30"))
+
 
 host = os.getenv("MONGO_URI", "localhost:27017")
 client: pymongo.MongoClient = pymongo.MongoClient(host=f"mongodb://{host}")
 mongodb = client.AssosConnect
 
+# Read preference of the read-only lookups (services, password login)
+# The writes and the reads that follow them always go to the primary
+READ_PREFERENCES = {
+    "primary": pymongo.ReadPreference.PRIMARY,
+    "primaryPreferred": pymongo.ReadPreference.PRIMARY_PREFERRED,
+    "secondary": pymongo.ReadPreference.SECONDARY,
+    "secondaryPreferred": pymongo.ReadPreference.SECONDARY_PREFERRED,
+    "nearest": pymongo.ReadPreference.NEAREST,
+}
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+if MONGO_READ_PREFERENCE not in READ_PREFERENCES:
+    raise ValueError(
+        f"Invalid MONGO_READ_PREFERENCE {MONGO_READ_PREFERENCE!r}, "
+        f"expected one of : {', '.join(READ_PREFERENCES)}"
+    )
+mongodb_read = client.get_database(
+    "AssosConnect", read_preference=READ_PREFERENCES[MONGO_READ_PREFERENCE]
+)
+
+# Cache of the service and user lookups : in-process if empty, else the url of
+# a Redis-compatible server shared by every instance (redis://host:port/db)
+CACHE_URL = os.getenv("CACHE_URL", "")
+# Prefix of the keys in the Redis server, which may be shared with other apps
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "eirbconnect:")
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
 # The secret key should be UNIQUE and SECRET
 # You may use the following command to generate a secret key:
 # openssl rand -hex 32
@@ -36,17 +72,49 @@ ACCES_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCES_TOKEN_EXPIRE_MINUTES", "30"))
 # encryption algorithm
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
+# Time the role claims of a user are cached (seconds), while the change stream
+# invalidates them, and without change stream (standalone MongoDB)
+CLAIMS_CACHE_TTL = float(os.getenv("CLAIMS_CACHE_TTL", "300"))
+CLAIMS_FALLBACK_TTL = float(os.getenv("CLAIMS_FALLBACK_TTL", "5"))
+
+# Templates : compiled bytecode cache (temp directory if empty) and reload
+# of the modified templates (for development)
+TEMPLATES_CACHE_DIR = os.getenv("TEMPLATES_CACHE_DIR", "")
+TEMPLATES_AUTO_RELOAD = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Tracing : spans are exported to a local file and/or an OTLP/HTTP collector
+TRACING_FILE = os.getenv("TRACING_FILE", "")
+TRACING_ENDPOINT = os.getenv("TRACING_ENDPOINT", "")
+
 
 def config_disp():
     return f"""Config :
 APP_URL={APP_URL}
 CAS_SERVICE_URL={CAS_SERVICE_URL}
 CAS_PROXY={CAS_PROXY}
+CAS_VALIDATE_URL={CAS_VALIDATE_URL}
+CAS_TIMEOUT={CAS_TIMEOUT}
+CAS_FALLBACK={CAS_FALLBACK}
+CAS_RETRY_AFTER={CAS_RETRY_AFTER}
 host={host}
+MONGO_READ_PREFERENCE={MONGO_READ_PREFERENCE}
+CACHE_URL={CACHE_URL}
+CACHE_PREFIX={CACHE_PREFIX}
+CACHE_TTL={CACHE_TTL}
 SECRET_KEY={SECRET_KEY}
 ACCESS_TOKEN_EXPIRE_MINUTES={ACCES_TOKEN_EXPIRE_MINUTES}
 ALGORITHM={ALGORITHM}
+CLAIMS_CACHE_TTL={CLAIMS_CACHE_TTL}
+CLAIMS_FALLBACK_TTL={CLAIMS_FALLBACK_TTL}
 ADMIN_PASS={ADMIN_PASS}
+TEMPLATES_CACHE_DIR={TEMPLATES_CACHE_DIR}
+TEMPLATES_AUTO_RELOAD={TEMPLATES_AUTO_RELOAD}
+TRACING_FILE={TRACING_FILE}
+TRACING_ENDPOINT={TRACING_ENDPOINT}
 """
 
 
@@ -3,16 +3,38 @@ EirbConnect : Service d'authentification des étudiants de l'ENSEIRB-MATMECA
 This is the main file of the application.
 """
 
+import asyncio
+import secrets
 from pathlib import Path
+from typing import Annotated
 
-from fastapi import FastAPI, Request, HTTPException, Form
+from fastapi import FastAPI, Request, HTTPException, Form, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, FileResponse
+from fastapi.responses import (
+    RedirectResponse,
+    FileResponse,
+    PlainTextResponse,
+)
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-
-from app.conf import APP_URL, CAS_PROXY, CAS_SERVICE_URL
+from starlette.concurrency import run_in_threadpool
+
+from app.conf import (
+    APP_URL,
+    CAS_PROXY,
+    CAS_SERVICE_URL,
+    CAS_FALLBACK,
+    TEMPLATES_CACHE_DIR,
+    TEMPLATES_AUTO_RELOAD,
+    ADMIN_PASS,
+    DEFAULT_ADMIN_PASS,
+)
 from app.utils import encrypt_service, resolve_service_url, encode_base64
+from app.tracing import span, parse_traceparent, SPAN_KIND_SERVER, TRACING_ENABLED
+from app.profiling import Profiler, profile_lock, MAX_DURATION
+from app.tasks import user_updates
+from app.templating import create_environment, precompile_templates, render_response
 from app.auth import (
     register_user,
     get_user,
@@ -23,6 +45,8 @@ from app.auth import (
     update_user,
     create_access_token,
     get_user_with_id_and_password,
+    is_cas_available,
+    CasUnavailableError,
 )
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -33,10 +57,17 @@ app.mount(
     "/static", StaticFiles(directory=str(Path(BASE_DIR, "static"))), name="static"
 )
 
-templates = Jinja2Templates(directory=str(Path(BASE_DIR, "templates")))
+templates = Jinja2Templates(
+    env=create_environment(TEMPLATES_CACHE_DIR, TEMPLATES_AUTO_RELOAD)
+)
+precompile_templates(templates.env)
 
 origins = [APP_URL]
 
+CAS_UNAVAILABLE_MESSAGE = (
+    "Le CAS ne répond pas, connectez-vous avec votre mot de passe EirbConnect"
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -45,13 +76,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+security = HTTPBasic()
+
+
+async def trace_request(request: Request, call_next):
+    """
+    Trace every request, as a child of the caller's trace if any
+    """
+    with span(
+        f"{request.method} {request.url.path}",
+        {"http.method": request.method, "http.target": request.url.path},
+        parent=parse_traceparent(request.headers.get("traceparent")),
+        kind=SPAN_KIND_SERVER,
+    ) as request_span:
+        response = await call_next(request)
+        if request_span:
+            request_span.set_attribute("http.status_code", response.status_code)
+        return response
+
+
+# Without tracing, no middleware (and no extra task per request)
+if TRACING_ENABLED:
+    app.middleware("http")(trace_request)
+
+
+async def template_response(name: str, context: dict):
+    """
+    Render a template (inside the request span)
+    """
+    with span("template.render", {"template": name}):
+        return await render_response(templates.env, name, context)
+
 
 @app.get("/")
 async def root(request: Request):
     """
     Page de présentation
     """
-    return templates.TemplateResponse(
+    return await template_response(
         name="index.html",
         context={
             "request": request,
@@ -87,6 +149,10 @@ async def auth(eirb_service_url: str = "EirbConnect"):
     if not encrypted_service:
         return HTTPException(status_code=403, detail="Service not whitelisted")
 
+    # Mode dégradé : le CAS est tombé, on propose la connexion par mot de passe
+    if not is_cas_available():
+        return RedirectResponse(url=f"/login?eirb_service_url={eirb_service_url}")
+
     redirect_url = f"{APP_URL}/auth/{encrypted_service}/login"
     service_url = redirect_url
 
@@ -103,6 +169,11 @@ async def auth_redirect(encrypted_service: str):
     """
     Endpoint pour redirection vers le CAS
     """
+    # Mode dégradé : le CAS est tombé, on propose la connexion par mot de passe
+    if not is_cas_available():
+        eirb_service_url = resolve_service_url(encrypted_service) or "EirbConnect"
+        return RedirectResponse(url=f"/login?eirb_service_url={eirb_service_url}")
+
     redirect_url = f"{APP_URL}/auth/{encrypted_service}/login"
 
     service_url = redirect_url
@@ -115,7 +186,7 @@ async def auth_redirect(encrypted_service: str):
 
 
 @app.get("/auth/{encrypted_service}/login")
-async def auth_login(encrypted_service: str, ticket: str):
+async def auth_login(request: Request, encrypted_service: str, ticket: str):
     """
     Login avec le CAS puis redirection vers "eirb_service_url"
     """
@@ -128,7 +199,24 @@ async def auth_login(encrypted_service: str, ticket: str):
         )
 
     # On récupère l'utilisateur CAS depuis le ticket
-    cas_user = get_cas_user_from_ticket(ticket, service_url)
+    # (hors de la boucle d'événements, pour ne pas bloquer les autres requêtes)
+    try:
+        cas_user = await run_in_threadpool(
+            get_cas_user_from_ticket, ticket, service_url
+        )
+    except CasUnavailableError as exc:
+        if not CAS_FALLBACK:
+            raise HTTPException(status_code=503, detail="CAS unavailable") from exc
+
+        # Mode dégradé : l'utilisateur peut se connecter avec son mot de passe
+        return await template_response(
+            name="login.html",
+            context={
+                "request": request,
+                "encrypted_service": encrypted_service,
+                "error": CAS_UNAVAILABLE_MESSAGE,
+            },
+        )
 
     if not cas_user:
         return HTTPException(status_code=403, detail="Invalid ticket")
@@ -150,17 +238,23 @@ async def auth_login(encrypted_service: str, ticket: str):
         )
 
     # Si l'utilisateur existe, on met a jour ses attributs "cas"
-    update_user(cas_user)
+    # (en mode dégradé, la mise à jour est faite en arrière-plan)
+    if CAS_FALLBACK:
+        user_updates.put(update_user, cas_user)
+    else:
+        update_user(cas_user)
 
     user_data = get_user_data(cas_user.user)
 
     if not user_data:
         return HTTPException(status_code=404, detail="User not found")
 
+    if CAS_FALLBACK:
+        user_data["attributes"].update(cas_user.attributes.model_dump())
+
     if eirb_service_url:
-        return RedirectResponse(
-            url=f"{eirb_service_url}?token={create_access_token(user_data)}"
-        )
+        token = create_access_token(user_data, eirb_service_url)
+        return RedirectResponse(url=f"{eirb_service_url}?token={token}")
 
     return user_data
 
@@ -175,11 +269,12 @@ async def login(request: Request, eirb_service_url: str = "EirbConnect"):
     if not encrypted_service:
         return HTTPException(status_code=403, detail="Service not whitelisted")
 
-    return templates.TemplateResponse(
+    return await template_response(
         name="login.html",
         context={
             "request": request,
             "encrypted_service": encrypted_service,
+            "error": None if is_cas_available() else CAS_UNAVAILABLE_MESSAGE,
         },
     )
 
@@ -199,7 +294,7 @@ async def login_post(
     user = get_user_with_id_and_password(cas_id, password)
 
     if not user:
-        return templates.TemplateResponse(
+        return await template_response(
             name="login.html",
             context={
                 "request": request,
@@ -208,13 +303,19 @@ async def login_post(
             },
         )
 
+    # Mêmes données que pour une connexion avec le CAS (sans le mot de passe)
+    user_data = {
+        key: value for key, value in user.model_dump().items() if key != "password"
+    }
+
     if eirb_service_url:
+        token = create_access_token(user_data, eirb_service_url)
         return RedirectResponse(
-            url=f"{eirb_service_url}?token={create_access_token(user.model_dump())}",
+            url=f"{eirb_service_url}?token={token}",
             status_code=303,
         )
 
-    return user
+    return user_data
 
 
 @app.get("/logout")
@@ -245,7 +346,7 @@ async def register(
     # Si le token est présent, on vérifie qu'il est valide
     cas_user = get_user_from_token(token)
 
-    return templates.TemplateResponse(
+    return await template_response(
         name="register.html",
         context={
             "request": request,
@@ -283,9 +384,8 @@ async def register_post(
         return HTTPException(status_code=404, detail="User not found")
 
     if eirb_service_url:
-        return RedirectResponse(
-            url=f"{eirb_service_url}?token={create_access_token(user)}"
-        )
+        token = create_access_token(user, eirb_service_url)
+        return RedirectResponse(url=f"{eirb_service_url}?token={token}")
 
     return user
 
@@ -296,3 +396,46 @@ def get_user_info(token: str):
     Endpoint pour récupérer les informations d'un utilisateur à partir d'un token
     """
     return get_user_data_from_token(token)
+
+
+def check_admin(credentials: Annotated[HTTPBasicCredentials, Depends(security)]):
+    """
+    Check the credentials of the eirbware admin account
+    """
+    if ADMIN_PASS == DEFAULT_ADMIN_PASS or not (
+        secrets.compare_digest(credentials.username.encode(), b"eirbware")
+        and secrets.compare_digest(credentials.password.encode(), ADMIN_PASS.encode())
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+
+
+@app.get("/debug/profile", include_in_schema=False, dependencies=[Depends(check_admin)])
+async def debug_profile(seconds: float = 10):
+    """
+    Endpoint pour profiler l'application pendant "seconds" secondes
+    (flamegraph au format "folded")
+    """
+    if not 0 < seconds <= MAX_DURATION:
+        raise HTTPException(
+            status_code=422, detail=f"seconds must be in ]0, {MAX_DURATION}]"
+        )
+
+    if not profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    try:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            # Also when the request is cancelled (client disconnect, shutdown),
+            # otherwise the sampling thread would run forever
+            stacks = profiler.stop()
+    finally:
+        profile_lock.release()
+    return PlainTextResponse(stacks)
@@ -0,0 +1,107 @@
+"""
+This module contains the on-demand sampling profiler
+
+The profiler samples the stacks of the event loop thread and of the
+threadpool workers (where the sync endpoints run) at a fixed interval,
+skipping the idle ones. The stacks are returned in the "folded" format (one
+"frame;frame;frame count" line per stack), which can be turned into a
+flamegraph with flamegraph.pl or opened directly in https://www.speedscope.app
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Time between two samples
+SAMPLE_INTERVAL = 0.005
+
+MAX_DURATION = 60
+
+# Only one profile can run at a time
+profile_lock = threading.Lock()
+
+# Name prefix of the threadpool workers of the sync endpoints (anyio)
+WORKER_THREAD_PREFIX = "AnyIO worker thread"
+
+# Top frames of a thread waiting for work : (file name, function)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+
+def _frame_name(frame) -> str:
+    """
+    Return the name of a frame in the flamegraph
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    """
+    Check if a thread is waiting for work
+    """
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def _sample(stacks: Counter, loop_thread: int):
+    """
+    Add the current stack of the event loop thread and of the busy
+    threadpool workers to "stacks"
+    """
+    workers = {
+        thread.ident
+        for thread in threading.enumerate()
+        if thread.name.startswith(WORKER_THREAD_PREFIX)
+    }
+    for thread_id, frame in sys._current_frames().items():
+        if thread_id != loop_thread and thread_id not in workers:
+            continue
+        if _is_idle(frame):
+            continue
+        stack = []
+        while frame:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        stacks[";".join(reversed(stack))] += 1
+
+
+class Profiler:
+    """
+    Sampling profiler running in a background thread
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        # Created by the profile endpoint, on the event loop thread
+        self.loop_thread = threading.get_ident()
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        """
+        Sampling loop
+        """
+        while not self.stop_event.is_set():
+            _sample(self.stacks, self.loop_thread)
+            time.sleep(self.interval)
+
+    def start(self):
+        """
+        Start sampling
+        """
+        self.thread.start()
+
+    def stop(self) -> str:
+        """
+        Stop sampling and return the folded stacks
+        """
+        self.stop_event.set()
+        self.thread.join()
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.items())
@@ -0,0 +1,237 @@
+"""
+This module contains the bulk import of CAS attributes
+
+Usage :
+    python -m app.sync export.csv
+    python -m app.sync export.ldif --chunk-size 500 --dry-run
+
+The CSV export must have a "user" column (the CAS id) and one column per
+CAS attribute. The LDIF export must have a "uid" attribute per entry.
+Only the users whose attributes changed are written.
+"""
+
+import argparse
+import base64
+import csv
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Iterator
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from pymongo import UpdateOne
+
+from app.conf import mongodb
+from app.models import CasUserAttributes
+
+# Attributes that come from the CAS (email_personnel is set by the user)
+CAS_ATTRIBUTES = list(CasUserAttributes.model_fields)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def read_csv(path: Path) -> Iterator[dict]:
+    """
+    Read the users from a CSV export
+    """
+    # utf-8-sig : the exports of Excel and of the LDAP tools start with a BOM
+    with open(path, newline="", encoding="utf-8-sig") as file:
+        for row in csv.DictReader(file):
+            yield row
+
+
+def parse_ldif_line(line: str) -> tuple[str, str]:
+    """
+    Parse an "attr: value" line of a LDIF export
+    The values can be base64 encoded ("attr:: value", used for the non-ASCII
+    values) or in a file ("attr:< file:///path")
+    """
+    key, _, value = line.partition(":")
+
+    if value.startswith(":"):
+        return key, base64.b64decode(value[1:].strip()).decode("utf-8")
+
+    if value.startswith("<"):
+        url = urlparse(value[1:].strip())
+        if url.scheme != "file":
+            raise ValueError(f"Unsupported LDIF url : {value[1:].strip()}")
+        return key, Path(url2pathname(url.path)).read_text(encoding="utf-8")
+
+    return key, value.strip()
+
+
+def read_ldif_entries(path: Path) -> Iterator[list[str]]:
+    """
+    Read the entries of a LDIF export as lists of unfolded lines
+    """
+    lines: list[str] = []
+
+    with open(path, encoding="utf-8-sig") as file:
+        for line in file:
+            line = line.rstrip("\r\n")
+
+            # A blank line ends the current entry
+            if not line.strip():
+                if lines:
+                    yield lines
+                lines = []
+                continue
+
+            if line.startswith("#"):
+                continue
+
+            # Folded line : continuation of the previous line
+            if line.startswith(" ") and lines:
+                lines[-1] += line[1:]
+                continue
+
+            lines.append(line)
+
+    if lines:
+        yield lines
+
+
+def read_ldif(path: Path) -> Iterator[dict]:
+    """
+    Read the users from a LDIF export
+    """
+    for lines in read_ldif_entries(path):
+        entry: dict = {}
+        for line in lines:
+            key, value = parse_ldif_line(line)
+            # Only the first value of multi-valued attributes is kept, like the CAS
+            entry.setdefault(key, value)
+        yield entry
+
+
+def read_export(path: Path) -> Iterator[dict]:
+    """
+    Read the users from an export, the format is guessed from the extension
+    """
+    if path.suffix.lower() == ".ldif":
+        for entry in read_ldif(path):
+            yield {"user": entry.get("uid", ""), **entry}
+    else:
+        yield from read_csv(path)
+
+
+def build_update(row: dict) -> tuple[dict, dict] | None:
+    """
+    Build the filter and the update of a user, the filter matching the
+    document only if one of its CAS attributes differs from the export
+    """
+    cas_id = (row.get("user") or "").strip()
+    if not cas_id:
+        return None
+
+    # Empty cells are ignored, so a blank column doesn't wipe an attribute
+    attributes = {}
+    for key in CAS_ATTRIBUTES:
+        value = (row.get(key) or "").strip()
+        if value:
+            attributes[key] = value
+    if not attributes:
+        return None
+
+    return (
+        {
+            "user": cas_id,
+            "$or": [
+                {f"attributes.{key}": {"$ne": value}}
+                for key, value in attributes.items()
+            ],
+        },
+        {"$set": {f"attributes.{key}": value for key, value in attributes.items()}},
+    )
+
+
+def chunks(operations: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    """
+    Split the operations in lists of "size" operations
+    """
+    chunk = []
+    for operation in operations:
+        chunk.append(operation)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def sync_users(path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Apply the CAS attributes of an export to the users in the db
+    The rows without user or without any attribute are skipped and counted
+    """
+    counts = {"read": 0, "skipped": 0}
+
+    def operations() -> Iterator[tuple[dict, dict]]:
+        for row in read_export(path):
+            counts["read"] += 1
+            operation = build_update(row)
+            if operation:
+                yield operation
+            else:
+                counts["skipped"] += 1
+
+    start = time.perf_counter()
+    modified = 0
+    updated = "to update" if dry_run else "updated"
+
+    def report() -> str:
+        return (
+            f"{counts['read']} rows read, {counts['skipped']} skipped, "
+            f"{modified} users {updated}"
+        )
+
+    for chunk in chunks(operations(), chunk_size):
+        if dry_run:
+            # Number of users that would be updated
+            modified += mongodb.utilisateurs.count_documents(
+                {"$or": [query for query, _ in chunk]}
+            )
+        else:
+            # No upsert : the users are created at registration, with a password
+            result = mongodb.utilisateurs.bulk_write(
+                [UpdateOne(query, update, upsert=False) for query, update in chunk],
+                ordered=False,
+            )
+            modified += result.modified_count
+
+        elapsed = time.perf_counter() - start
+        print(f"{report()} ({counts['read'] / elapsed:.0f} rows/s)", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"Done : {report()} in {elapsed:.1f} s")
+    return counts["read"], counts["skipped"], modified
+
+
+def main(argv: list[str] | None = None):
+    """
+    Entry point of the command line
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m app.sync",
+        description="Met à jour les attributs CAS des utilisateurs depuis un export CSV ou LDIF",
+    )
+    parser.add_argument("export", type=Path, help="fichier .csv ou .ldif")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="nombre d'utilisateurs par bulk_write",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="compte les utilisateurs à mettre à jour sans écrire dans la base",
+    )
+    args = parser.parse_args(argv)
+
+    sync_users(args.export, args.chunk_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+This module contains the background retry queue
+
+The tasks are run one after the other in a background thread, a failed task
+is retried later with an exponential backoff.
+"""
+
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from pymongo.errors import PyMongoError
+
+MAX_ATTEMPTS = 5
+
+# Delay before the first retry, doubled at each attempt
+RETRY_DELAY = 2.0
+
+# Time between two checks while waiting for a retry
+POLL_INTERVAL = 0.1
+
+
+@dataclass(order=True)
+class Task:
+    """
+    Task model
+    """
+
+    run_at: float
+    func: Callable = field(compare=False)
+    args: tuple = field(compare=False, default=())
+    attempts: int = field(compare=False, default=0)
+
+
+class RetryQueue:
+    """
+    Queue of tasks run in a background thread
+    """
+
+    def __init__(self, retry_on: tuple[type[Exception], ...] = (PyMongoError,)):
+        self.retry_on = retry_on
+        self.tasks: queue.PriorityQueue[Task] = queue.PriorityQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, func: Callable, *args):
+        """
+        Queue a call of func(*args)
+        """
+        self.tasks.put(Task(run_at=time.monotonic(), func=func, args=args))
+
+    def run(self):
+        """
+        Worker loop
+        """
+        while True:
+            task = self.tasks.get()
+
+            delay = task.run_at - time.monotonic()
+            if delay > 0:
+                # Not ready yet : put it back and wait (a new task may be ready before)
+                self.tasks.put(task)
+                time.sleep(min(delay, POLL_INTERVAL))
+                continue
+
+            try:
+                task.func(*task.args)
+            except self.retry_on as exc:
+                task.attempts += 1
+                if task.attempts >= MAX_ATTEMPTS:
+                    print(
+                        f"Task {task.func.__name__} failed {task.attempts} times : {exc}"
+                    )
+                    continue
+                task.run_at = time.monotonic() + RETRY_DELAY * 2 ** (task.attempts - 1)
+                self.tasks.put(task)
+            except Exception as exc:  # pylint: disable=broad-except
+                print(f"Task {task.func.__name__} failed : {exc}")
+
+
+user_updates = RetryQueue()
@@ -0,0 +1,93 @@
+"""
+This module contains the template environment
+
+The templates are rendered with Jinja's async mode. A page is rendered in
+memory and only streamed past STREAM_CHUNK_SIZE, so a render error of a
+small page is still a clean 500 instead of a truncated 200. The templates are
+compiled once at startup, and the compiled bytecode is cached on disk so a
+new worker doesn't compile them again.
+"""
+
+from pathlib import Path
+from typing import AsyncIterator
+
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+)
+from starlette.responses import HTMLResponse, Response, StreamingResponse
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
+
+# Size from which a page is streamed, also the minimal size of a streamed
+# chunk to avoid sending every text node separately
+STREAM_CHUNK_SIZE = 16384
+
+
+def create_environment(cache_dir: str = "", auto_reload: bool = False) -> Environment:
+    """
+    Create the template environment
+    The bytecode is cached in "cache_dir" (in the temp directory if empty)
+    """
+    if cache_dir:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    else:
+        bytecode_cache = FileSystemBytecodeCache()
+
+    return Environment(
+        loader=FileSystemLoader(TEMPLATES_DIR),
+        autoescape=select_autoescape(),
+        enable_async=True,
+        bytecode_cache=bytecode_cache,
+        # Without auto reload, a compiled template is used without checking the file
+        auto_reload=auto_reload,
+    )
+
+
+def precompile_templates(env: Environment):
+    """
+    Compile every template and keep it in the environment cache
+    """
+    for name in env.list_templates(extensions=["html"]):
+        env.get_template(name)
+
+
+async def _read_chunk(texts: AsyncIterator[str]) -> str:
+    """
+    Read at least STREAM_CHUNK_SIZE characters (less at the end of the page)
+    """
+    buffer: list[str] = []
+    size = 0
+    async for text in texts:
+        buffer.append(text)
+        size += len(text)
+        if size >= STREAM_CHUNK_SIZE:
+            break
+    return "".join(buffer)
+
+
+async def _stream(first_chunk: str, texts: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Stream the rest of a page
+    """
+    chunk = first_chunk
+    while chunk:
+        yield chunk
+        chunk = await _read_chunk(texts)
+
+
+async def render_response(env: Environment, name: str, context: dict) -> Response:
+    """
+    Render a template, streamed only if it is larger than STREAM_CHUNK_SIZE
+    """
+    texts = env.get_template(name).generate_async(context)
+    first_chunk = await _read_chunk(texts)
+
+    if len(first_chunk) < STREAM_CHUNK_SIZE:
+        return HTMLResponse(first_chunk)
+    return StreamingResponse(
+        _stream(first_chunk, texts), media_type="text/html; charset=utf-8"
+    )
@@ -0,0 +1,255 @@
+"""
+This module contains the request tracing
+
+The spans are exported in the OTLP/JSON format (one ExportTraceServiceRequest
+per line), either to a local file (TRACING_FILE) or to an OTLP/HTTP collector
+(TRACING_ENDPOINT, for example http://localhost:4318/v1/traces).
+Tracing is disabled when none of them is set.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+import requests
+
+from app.conf import TRACING_FILE, TRACING_ENDPOINT
+
+TRACING_ENABLED = bool(TRACING_FILE or TRACING_ENDPOINT)
+
+SERVICE_NAME = "EirbConnect"
+
+# Time between two exports of the finished spans
+EXPORT_INTERVAL = 1.0
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+
+
+@dataclass
+class Span:
+    """
+    Span model
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: str = ""
+    kind: int = SPAN_KIND_INTERNAL
+    attributes: dict = field(default_factory=dict)
+    start_time: int = field(default_factory=time.time_ns)
+    end_time: int = 0
+    error: str = ""
+
+    def set_attribute(self, key: str, value):
+        """
+        Add an attribute to the span
+        """
+        self.attributes[key] = value
+
+    def to_otlp(self) -> dict:
+        """
+        Return the span in the OTLP/JSON format
+        """
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time),
+            "endTimeUnixNano": str(self.end_time),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    """
+    Convert an attribute to the OTLP/JSON format
+    """
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Exporter:
+    """
+    Export the finished spans in batches from a background thread
+    """
+
+    def __init__(self):
+        self.spans: queue.Queue[Span] = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def export(self, span: Span):
+        """
+        Queue a finished span
+        """
+        self.spans.put(span)
+
+    def run(self):
+        """
+        Export loop
+        """
+        while True:
+            time.sleep(EXPORT_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """
+        Export all the queued spans
+        """
+        spans = []
+        # The exporter thread and the atexit flush may empty the queue together
+        while True:
+            try:
+                spans.append(self.spans.get_nowait().to_otlp())
+            except queue.Empty:
+                break
+        if not spans:
+            return
+
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_otlp_attribute("service.name", SERVICE_NAME)]
+                    },
+                    "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+                }
+            ]
+        }
+
+        try:
+            if TRACING_FILE:
+                with open(TRACING_FILE, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(request) + "\n")
+            if TRACING_ENDPOINT:
+                requests.post(TRACING_ENDPOINT, json=request, timeout=2)
+        except (OSError, requests.RequestException) as exc:
+            print(f"Tracing export failed : {exc}")
+
+
+exporter = Exporter() if TRACING_ENABLED else None
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def _new_id(size: int) -> str:
+    """
+    Generate a random hex id of "size" bytes
+    """
+    return f"{random.getrandbits(size * 8):0{size * 2}x}"
+
+
+def _is_valid_id(value: str, size: int) -> bool:
+    """
+    Check that an id is "size" hex digits and not all zeros (invalid in W3C)
+    """
+    return (
+        len(value) == size
+        and all(char in "0123456789abcdef" for char in value)
+        and value != "0" * size
+    )
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str] | None:
+    """
+    Return the trace id and the parent span id of a W3C traceparent header
+    """
+    if not header:
+        return None
+    parts = header.strip().lower().split("-")
+    if len(parts) != 4:
+        return None
+    trace_id, span_id = parts[1], parts[2]
+    if not (_is_valid_id(trace_id, 32) and _is_valid_id(span_id, 16)):
+        return None
+    return trace_id, span_id
+
+
+@contextmanager
+def span(
+    name: str,
+    attributes: dict | None = None,
+    parent: tuple[str, str] | None = None,
+    kind: int = SPAN_KIND_INTERNAL,
+):
+    """
+    Trace the execution of a block, as a child of the current span
+    (or of "parent", a (trace id, span id) tuple, for the root span)
+    "kind" is SPAN_KIND_SERVER for the span of a received request
+    """
+    if not exporter:
+        yield None
+        return
+
+    current = current_span.get()
+    if current:
+        trace_id, parent_span_id = current.trace_id, current.span_id
+    elif parent:
+        trace_id, parent_span_id = parent
+    else:
+        trace_id, parent_span_id = _new_id(16), ""
+
+    new_span = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=_new_id(8),
+        parent_span_id=parent_span_id,
+        kind=kind,
+        attributes=dict(attributes or {}),
+    )
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except Exception as exc:
+        new_span.error = repr(exc)
+        raise
+    finally:
+        new_span.end_time = time.time_ns()
+        current_span.reset(token)
+        exporter.export(new_span)
+
+
+def traced(func):
+    """
+    Decorator to trace every call of a function
+    """
+    if not TRACING_ENABLED:
+        return func
+
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
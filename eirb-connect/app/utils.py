@@ -3,13 +3,16 @@ This module contains helper functions
 """
 
 import base64
-from app.conf import mongodb
+from app.conf import mongodb_read
+from app.cache import cached
+from app.tracing import traced
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 # Helper password functions
+@traced
 def verify_password(plain_password, hashed_password):
     """
     Helper function to check if a password matches a hashed password
@@ -17,6 +20,7 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+@traced
 def get_password_hash(password):
     """
     Helper function to generate a hashed password
@@ -24,26 +28,52 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+@traced
+def get_service(field: str, value: str) -> dict | None:
+    """
+    Get a service by "service_url" or "hash", from the shared cache
+    """
+    return cached(
+        f"service:{field}:{value}",
+        lambda: mongodb_read.services.find_one({field: value}, {"_id": 0}),
+    )
+
+
+@traced
 def encrypt_service(service_url: str) -> str | None:
     """
     Check if the user is whitelisted
     """
-    service = mongodb.services.find_one({"service_url": service_url})
+    service = get_service("service_url", service_url)
     if service:
         return service["hash"]
     return None
 
 
+@traced
 def resolve_service_url(hashed_url: str) -> str | None:
     """
     Resolve a service url
     """
-    service = mongodb.services.find_one({"hash": hashed_url})
+    service = get_service("hash", hashed_url)
     if service and service["service_url"] != "EirbConnect":
         return service["service_url"]
     return None
 
 
+@traced
+def get_service_scope(service_url: str | None) -> list[str] | None:
+    """
+    Get the assos whose roles are sent to a service (None for every asso)
+    """
+    if not service_url:
+        return None
+    service = get_service("service_url", service_url)
+    if service:
+        return service.get("roles_scope")
+    return None
+
+
 def encode_base64(string: str) -> str:
     """
     Encode a string in base64
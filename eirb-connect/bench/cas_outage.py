@@ -0,0 +1,148 @@
+"""
+Measure the latency of the CAS login during a CAS outage
+
+A fake CAS is started locally. EirbConnect must be running and configured
+to validate the tickets against it, for example :
+
+    CAS_VALIDATE_URL=http://127.0.0.1:8900/serviceValidate CAS_FALLBACK=true APP_URL=http://127.0.0.1:8000 ./run.sh
+    python bench/cas_outage.py --app-url http://127.0.0.1:8000 --delay 10
+
+--app-url must be the APP_URL of EirbConnect (it is used to compute the hash
+of the EirbConnect service). With --delay 0 the fake CAS answers immediately
+with a valid user.
+
+While the CAS logins run, /login is requested in a loop to check that the
+other requests are not blocked by the CAS validation.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+FAKE_USER = {
+    "user": "jdupont",
+    "attributes": {
+        "nom": ["Dupont"],
+        "prenom": ["Jean"],
+        "courriel": ["jean.dupont@enseirb-matmeca.fr"],
+        "profil": ["etudiant"],
+        "nom_complet": ["Jean Dupont"],
+        "ecole": ["enseirb-matmeca"],
+        "diplome": ["informatique"],
+        "supannEtuAnneeInscription": ["2024"],
+    },
+}
+
+
+def fake_cas(delay: float):
+    """
+    Return the request handler of a CAS answering after "delay" seconds
+    """
+
+    class FakeCasHandler(BaseHTTPRequestHandler):
+        """
+        Fake CAS /serviceValidate endpoint
+        """
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """
+            Answer with a valid user after the delay
+            """
+            time.sleep(delay)
+            body = json.dumps(
+                {"serviceResponse": {"authenticationSuccess": FAKE_USER}}
+            ).encode()
+            try:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # EirbConnect gave up waiting
+                pass
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return FakeCasHandler
+
+
+def summary(latencies: list[float]) -> str:
+    """
+    Return the p50, p95 and max of latencies (s) in ms
+    """
+    latencies = sorted(latencies)
+    return (
+        f"p50={statistics.median(latencies) * 1000:.0f} "
+        f"p95={latencies[math.ceil(len(latencies) * 0.95) - 1] * 1000:.0f} "
+        f"max={latencies[-1] * 1000:.0f}"
+    )
+
+
+def poll(url: str, latencies: list[float], stop: threading.Event):
+    """
+    Request url in a loop until "stop" is set
+    """
+    while not stop.is_set():
+        start = time.perf_counter()
+        requests.get(url, timeout=60)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.05)
+
+
+def main():
+    """
+    Start the fake CAS and measure the login latency
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--app-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--delay", type=float, default=10, help="CAS delay (s)")
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), fake_cas(args.delay))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # Hash of the EirbConnect service (see app.conf)
+    encrypted_service = hashlib.md5(args.app_url.encode()).hexdigest()
+    url = f"{args.app_url}/auth/{encrypted_service}/login"
+
+    other_latencies: list[float] = []
+    stop = threading.Event()
+    poller = threading.Thread(
+        target=poll, args=(f"{args.app_url}/login", other_latencies, stop)
+    )
+    poller.start()
+
+    latencies = []
+    statuses: dict[int, int] = {}
+    for i in range(args.requests):
+        start = time.perf_counter()
+        response = requests.get(
+            url, params={"ticket": f"ST-{i}"}, allow_redirects=False, timeout=60
+        )
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    stop.set()
+    poller.join()
+    server.shutdown()
+
+    print(f"CAS delay : {args.delay} s, {args.requests} logins")
+    print(f"status codes : {statuses}")
+    print(f"CAS login latency (ms) : {summary(latencies)}")
+    print(f"/login latency meanwhile (ms) : {summary(other_latencies)}")
+
+
+if __name__ == "__main__":
+    main()
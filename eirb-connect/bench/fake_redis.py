@@ -0,0 +1,135 @@
+"""
+Minimal Redis-compatible server, to run the shared cache locally without Redis
+
+    python bench/fake_redis.py --port 6390
+    CACHE_URL=redis://127.0.0.1:6390/0 ./run.sh
+
+Only the commands used by app.cache are supported (PING, GET, SET with
+EX/PX, DEL, SCAN, FLUSHDB), the data is kept in memory.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import time
+
+# key -> (expiration time or None, value)
+data: dict[bytes, tuple[float | None, bytes]] = {}
+
+
+def encode(value) -> bytes:
+    """
+    Encode a reply in the RESP2 protocol
+    """
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, Exception):
+        return f"-ERR {value}\r\n".encode()
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def get(key: bytes) -> bytes | None:
+    """
+    Get a value, None if missing or expired
+    """
+    expires, value = data.get(key, (None, None))
+    if expires is not None and expires <= time.monotonic():
+        del data[key]
+        return None
+    return value
+
+
+def execute(command: list[bytes]):
+    """
+    Execute a command and return its reply
+    """
+    name, args = command[0].upper(), command[1:]
+
+    if name == b"PING":
+        return "PONG"
+    if name == b"GET":
+        return get(args[0])
+    if name == b"SET":
+        expires = None
+        options = [arg.upper() for arg in args[2:]]
+        if b"EX" in options:
+            expires = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+        if b"PX" in options:
+            expires = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+        data[args[0]] = (expires, args[1])
+        return "OK"
+    if name == b"DEL":
+        return sum(data.pop(key, None) is not None for key in args)
+    if name == b"SCAN":
+        options = [arg.upper() for arg in args]
+        pattern = args[options.index(b"MATCH") + 1] if b"MATCH" in options else b"*"
+        keys = [
+            key
+            for key in list(data)
+            if get(key) is not None and fnmatch.fnmatchcase(key, pattern)
+        ]
+        # Every key in one iteration
+        return [b"0", keys]
+    if name == b"FLUSHDB":
+        data.clear()
+        return "OK"
+    return Exception(f"unknown command '{name.decode()}'")
+
+
+async def read_command(reader: asyncio.StreamReader) -> list[bytes]:
+    """
+    Read a command (array of bulk strings)
+    """
+    header = await reader.readline()
+    if not header:
+        raise ConnectionError
+    if not header.startswith(b"*"):
+        # Inline command
+        return header.split()
+
+    command = []
+    for _ in range(int(header[1:])):
+        size = int((await reader.readline())[1:])
+        command.append((await reader.readexactly(size + 2))[:-2])
+    return command
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Handle a client connection
+    """
+    try:
+        while True:
+            command = await read_command(reader)
+            if command:
+                writer.write(encode(execute(command)))
+                await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main():
+    """
+    Start the server
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    server = await asyncio.start_server(handle, args.host, args.port)
+    print(f"Fake Redis listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+"""
+Measure the render time of every page
+
+    python bench/render_templates.py --iterations 1000
+
+The application setup (async mode, bytecode cache, no auto reload) is
+compared with the previous one, a sync Jinja2Templates(directory=...) and
+its TemplateResponse, in each case :
+  - cold : new environment without bytecode cache (the template is compiled)
+  - bytecode : new environment loading the bytecode cached on disk
+    (application setup only)
+  - warm : template already compiled by the environment (steady state)
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from jinja2 import Environment
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from app.templating import create_environment, render_response, TEMPLATES_DIR
+
+app = Starlette(
+    routes=[
+        Mount(
+            "/static",
+            StaticFiles(directory=str(TEMPLATES_DIR.parent / "static")),
+            name="static",
+        )
+    ]
+)
+
+request = Request(
+    {
+        "type": "http",
+        "app": app,
+        "router": app.router,
+        "scheme": "http",
+        "server": ("127.0.0.1", 8080),
+        "path": "/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+    }
+)
+
+cas_user = SimpleNamespace(
+    user="jdupont",
+    attributes=SimpleNamespace(
+        nom="Dupont",
+        prenom="Jean",
+        courriel="jean.dupont@enseirb-matmeca.fr",
+        profil="etudiant",
+        nom_complet="Jean Dupont",
+        ecole="enseirb-matmeca",
+        diplome="informatique",
+        supannEtuAnneeInscription="2024",
+    ),
+)
+
+PAGES = {
+    "index.html": {},
+    "login.html": {"encrypted_service": "0" * 32, "error": "Erreur"},
+    "register.html": {
+        "cas_user": cas_user,
+        "token": "x" * 200,
+        "encrypted_service": "0" * 32,
+    },
+}
+
+
+def new_environment(cache_dir: str | None) -> Environment:
+    """
+    New environment with url_for, with or without bytecode cache
+    """
+    env = create_environment(cache_dir or "")
+    if cache_dir is None:
+        env.bytecode_cache = None
+    Jinja2Templates(env=env)
+    return env
+
+
+async def render(env: Environment, name: str) -> bytes:
+    """
+    Render a page like the application
+    """
+    context = {"request": request, **PAGES[name]}
+    return (await render_response(env, name, context)).body
+
+
+def render_sync(templates: Jinja2Templates, name: str) -> bytes:
+    """
+    Render a page like the previous version of the application
+    """
+    return templates.TemplateResponse(request, name, dict(PAGES[name])).body
+
+
+async def measure(name: str, iterations: int, cache_dir: str) -> dict[str, float]:
+    """
+    Mean render time of a page in each case (ms)
+    """
+    results = {}
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render_sync(Jinja2Templates(directory=str(TEMPLATES_DIR)), name)
+    results["sync cold"] = (time.perf_counter() - start) / iterations * 1000
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await render(new_environment(None), name)
+    results["cold"] = (time.perf_counter() - start) / iterations * 1000
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await render(new_environment(cache_dir), name)
+    results["bytecode"] = (time.perf_counter() - start) / iterations * 1000
+
+    templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+    render_sync(templates, name)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render_sync(templates, name)
+    results["sync warm"] = (time.perf_counter() - start) / iterations * 1000
+
+    env = new_environment(cache_dir)
+    await render(env, name)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await render(env, name)
+    results["warm"] = (time.perf_counter() - start) / iterations * 1000
+
+    return results
+
+
+async def main():
+    """
+    Measure every page
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Fill the bytecode cache
+        for name in PAGES:
+            await render(new_environment(cache_dir), name)
+
+        columns = ["sync cold", "cold", "bytecode", "sync warm", "warm"]
+        print(f"{'page':<15}" + "".join(f"{column:>11}" for column in columns))
+        for name in PAGES:
+            results = await measure(name, args.iterations, cache_dir)
+            print(
+                f"{name:<15}"
+                + "".join(f"{results[column]:>11.3f}" for column in columns)
+            )
+        print("(ms per render)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())